@@ -3,8 +3,17 @@ import json
 import hmac
 import hashlib
 import requests
+from requests.adapters import HTTPAdapter
 import time
-from flask import Flask, request, jsonify
+import sys
+import socket
+import sqlite3
+import threading
+import contextlib
+import uuid
+from functools import wraps
+from urllib.parse import urlparse
+from flask import Flask, request, jsonify, g
 import logging
 
 # Configure logging
@@ -18,6 +27,30 @@ FLUTTERWAVE_SECRET_KEY = os.getenv('FLUTTERWAVE_SECRET_KEY')
 FLUTTERWAVE_WEBHOOK_SECRET = os.getenv('FLUTTERWAVE_WEBHOOK_SECRET')
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 TELEGRAM_CHANNEL_ID = os.getenv('TELEGRAM_CHANNEL_ID')
+ADMIN_API_TOKEN = os.getenv('ADMIN_API_TOKEN')
+DATABASE_PATH = os.getenv('DATABASE_PATH', 'bot.db')
+TELEGRAM_API_BASE = os.getenv('TELEGRAM_API_BASE', 'https://api.telegram.org')
+FLUTTERWAVE_API_BASE = os.getenv('FLUTTERWAVE_API_BASE', 'https://api.flutterwave.com')
+HEALTH_PROBE_INTERVAL = int(os.getenv('HEALTH_PROBE_INTERVAL', '30'))
+HEALTH_CACHE_TTL = int(os.getenv('HEALTH_CACHE_TTL', '90'))
+STARTUP_WARMUP = os.getenv('STARTUP_WARMUP', 'true').lower() == 'true'
+WEBHOOK_CAPTURE_PATH = os.getenv('WEBHOOK_CAPTURE_PATH')
+SHARED_STATE_URL = os.getenv('SHARED_STATE_URL', f"sqlite:///{DATABASE_PATH}")
+NODE_ID = os.getenv('NODE_ID', f"{socket.gethostname()}-{os.getpid()}")
+LEASE_TTL = int(os.getenv('LEASE_TTL', '15'))
+INVITE_LINK_TTL = 7 * 24 * 60 * 60
+INVITE_SWEEP_INTERVAL = int(os.getenv('INVITE_SWEEP_INTERVAL', '300'))
+INVITE_REVOKE_BATCH = int(os.getenv('INVITE_REVOKE_BATCH', '100'))
+
+# (connect, read) timeout for upstream calls; a whole fulfillment must stay well
+# inside ClusterCoordinator.PROCESSING_TTL so its claim cannot expire mid-way
+UPSTREAM_TIMEOUT = (5, 10)
+
+# Shared HTTP session so upstream connections are pooled and can be pre-warmed
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+PROCESS_STARTED_AT = time.time()
 
 class FlutterwavePaymentBot:
     def __init__(self):
@@ -45,14 +78,15 @@ class FlutterwavePaymentBot:
         if not self.secret_key:
             return {"status": "error", "message": "No secret key"}
             
-        url = f"https://api.flutterwave.com/v3/transactions/{transaction_id}/verify"
+        url = f"{FLUTTERWAVE_API_BASE}/v3/transactions/{transaction_id}/verify"
         headers = {
             "Authorization": f"Bearer {self.secret_key}",
             "Content-Type": "application/json"
         }
         
         try:
-            response = requests.get(url, headers=headers)
+            with profiler.span("upstream.flutterwave_verify"):
+                response = http_session.get(url, headers=headers, timeout=UPSTREAM_TIMEOUT)
             response.raise_for_status()
             return response.json()
         except requests.RequestException as e:
@@ -65,7 +99,7 @@ class FlutterwavePaymentBot:
             logger.error("No Telegram bot token")
             return False
             
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+        url = f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
         data = {
             "chat_id": user_id,
             "text": message,
@@ -77,7 +111,8 @@ class FlutterwavePaymentBot:
             data["reply_markup"] = reply_markup
         
         try:
-            response = requests.post(url, json=data)
+            with profiler.span("upstream.telegram_send_message"):
+                response = http_session.post(url, json=data, timeout=UPSTREAM_TIMEOUT)
             response.raise_for_status()
             logger.info(f"Message sent to user {user_id}")
             return True
@@ -90,16 +125,17 @@ class FlutterwavePaymentBot:
         if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHANNEL_ID:
             return None
             
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/createChatInviteLink"
+        url = f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}/createChatInviteLink"
         data = {
             "chat_id": TELEGRAM_CHANNEL_ID,
             "member_limit": 1,
             "name": f"Payment access for user {user_id}",
-            "expire_date": int(time.time()) + (7 * 24 * 60 * 60)  # Expires in 7 days
+            "expire_date": int(time.time()) + INVITE_LINK_TTL  # Expires in 7 days
         }
         
         try:
-            response = requests.post(url, json=data)
+            with profiler.span("upstream.telegram_create_invite_link"):
+                response = http_session.post(url, json=data, timeout=UPSTREAM_TIMEOUT)
             response.raise_for_status()
             result = response.json()
             if result.get("ok"):
@@ -109,9 +145,118 @@ class FlutterwavePaymentBot:
             
         return None
     
+    def revoke_invite_link(self, invite_link):
+        """Revoke an invite link; True once the link is no longer usable"""
+        if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHANNEL_ID:
+            return False
+            
+        url = f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}/revokeChatInviteLink"
+        data = {"chat_id": TELEGRAM_CHANNEL_ID, "invite_link": invite_link}
+        
+        try:
+            with profiler.span("upstream.telegram_revoke_invite_link"):
+                response = http_session.post(url, json=data, timeout=UPSTREAM_TIMEOUT)
+            if response.status_code == 400:
+                # Already revoked, or unknown to Telegram: nothing left to revoke
+                logger.warning(f"Telegram rejected revoking {invite_link}: {response.text}")
+                return True
+            response.raise_for_status()
+            return response.json().get("ok", False)
+        except requests.RequestException as e:
+            logger.error(f"Failed to revoke invite link: {e}")
+            return False
+    
+    def approve_join_request(self, chat_id, user_id):
+        """Approve a pending request to join the channel"""
+        if not TELEGRAM_BOT_TOKEN:
+            return False
+            
+        url = f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}/approveChatJoinRequest"
+        data = {"chat_id": chat_id, "user_id": user_id}
+        
+        try:
+            with profiler.span("upstream.telegram_approve_join_request"):
+                response = http_session.post(url, json=data, timeout=UPSTREAM_TIMEOUT)
+            response.raise_for_status()
+            logger.info(f"Approved join request from user {user_id}")
+            return True
+        except requests.RequestException as e:
+            logger.error(f"Failed to approve join request: {e}")
+            return False
+    
+    def is_channel(self, chat):
+        """Whether an update's chat is the paid channel (TELEGRAM_CHANNEL_ID may be an @name)"""
+        if not TELEGRAM_CHANNEL_ID:
+            return False
+        if not TELEGRAM_CHANNEL_ID.startswith("@"):
+            return str(chat.get("id")) == TELEGRAM_CHANNEL_ID
+        
+        # Public channels carry their username, so an @name matches without a lookup
+        if chat.get("username") and f"@{chat['username']}".lower() == TELEGRAM_CHANNEL_ID.lower():
+            return True
+        channel = health_monitor.channel or health_monitor.resolve_channel()
+        if not channel:
+            logger.error(f"Channel {TELEGRAM_CHANNEL_ID} is unresolved; cannot tell whether chat "
+                         f"{chat.get('id')} is the channel, ignoring its update")
+            return False
+        return str(chat.get("id")) == str(channel["id"])
+    
+    def process_chat_member(self, chat_member):
+        """Map channel joins back to the payment whose invite link was used"""
+        if not self.is_channel(chat_member.get("chat", {})):
+            logger.info(f"Ignoring chat_member update from chat {chat_member.get('chat', {}).get('id')}")
+            return
+        
+        old = chat_member.get("old_chat_member", {})
+        new = chat_member.get("new_chat_member", {})
+        
+        def is_member(member):
+            status = member.get("status")
+            return status in ("member", "administrator", "creator") or (
+                status == "restricted" and member.get("is_member", False))
+        
+        if is_member(old) or not is_member(new):
+            return
+        
+        user_id = new["user"]["id"]
+        joined_at = chat_member.get("date", int(time.time()))
+        invite_link = chat_member.get("invite_link", {}).get("invite_link")
+        
+        if invite_link:
+            transaction_id = invite_tracker.mark_joined(invite_link, user_id, joined_at)
+        else:
+            transaction_id = invite_tracker.mark_joined_by_user(user_id, joined_at)
+        
+        if transaction_id:
+            logger.info(f"User {user_id} joined the channel for transaction {transaction_id}")
+        else:
+            logger.info(f"User {user_id} joined the channel without a tracked invite link")
+    
+    def process_join_request(self, join_request):
+        """Auto-approve join requests from users who have paid"""
+        if not self.is_channel(join_request["chat"]):
+            logger.info(f"Ignoring join request for chat {join_request['chat'].get('id')}")
+            return
+        
+        user_id = join_request["from"]["id"]
+        chat_id = join_request["chat"]["id"]
+        
+        if invite_tracker.is_paid_user(user_id):
+            self.approve_join_request(chat_id, user_id)
+        else:
+            logger.info(f"Join request from unpaid user {user_id} left pending")
+    
     def process_telegram_update(self, update_data):
-        """Process incoming Telegram messages"""
+        """Process incoming Telegram messages, channel joins and join requests"""
         try:
+            if "chat_member" in update_data:
+                self.process_chat_member(update_data["chat_member"])
+                return
+            
+            if "chat_join_request" in update_data:
+                self.process_join_request(update_data["chat_join_request"])
+                return
+            
             if "message" not in update_data:
                 return
                 
@@ -121,7 +266,8 @@ class FlutterwavePaymentBot:
             first_name = message["from"].get("first_name", "User")
             text = message.get("text", "")
             
-            logger.info(f"Message from user {user_id}: {text}")
+            with profiler.span("logging"):
+                logger.info(f"Message from user {user_id}: {text}")
             
             # Handle /start command
             if text.startswith("/start"):
@@ -176,8 +322,958 @@ Type /start to see the full welcome message.
         except Exception as e:
             logger.error(f"Error processing Telegram update: {e}")
 
+class PaymentAnalytics:
+    """Local store of fulfilled transactions with per-minute/hour/day rollups"""
+
+    # Rollup granularities in seconds, coarsest first
+    GRANULARITIES = {"day": 86400, "hour": 3600, "minute": 60}
+
+    def __init__(self, db_path=DATABASE_PATH):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS transactions (
+                id INTEGER PRIMARY KEY,
+                transaction_id TEXT,
+                user_id TEXT,
+                amount REAL,
+                currency TEXT,
+                outcome TEXT,
+                created_at INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_transactions_created_at ON transactions (created_at);
+            CREATE TABLE IF NOT EXISTS rollups (
+                granularity TEXT,
+                bucket INTEGER,
+                currency TEXT,
+                outcome TEXT,
+                count INTEGER,
+                amount REAL,
+                PRIMARY KEY (granularity, bucket, currency, outcome)
+            ) WITHOUT ROWID;
+        """)
+        self.conn.commit()
+
+    def record(self, transaction_id, user_id, amount, currency, outcome, timestamp=None):
+        """Append a fulfilled transaction and update its rollups"""
+        created_at = int(timestamp if timestamp is not None else time.time())
+        amount = float(amount or 0)
+        currency = currency or "UNKNOWN"
+
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO transactions (transaction_id, user_id, amount, currency, outcome, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (str(transaction_id), str(user_id), amount, currency, outcome, created_at)
+            )
+            self.conn.executemany(
+                "INSERT INTO rollups (granularity, bucket, currency, outcome, count, amount) "
+                "VALUES (?, ?, ?, ?, 1, ?) "
+                "ON CONFLICT (granularity, bucket, currency, outcome) "
+                "DO UPDATE SET count = count + 1, amount = amount + excluded.amount",
+                [
+                    (name, created_at - created_at % size, currency, outcome, amount)
+                    for name, size in self.GRANULARITIES.items()
+                ]
+            )
+
+    def rebuild_rollups(self):
+        """Recompute all rollups from the raw transactions (backfills, bulk loads)"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM rollups")
+            for name, size in self.GRANULARITIES.items():
+                self.conn.execute(
+                    "INSERT INTO rollups (granularity, bucket, currency, outcome, count, amount) "
+                    "SELECT ?, created_at - created_at % ?, currency, outcome, COUNT(*), SUM(amount) "
+                    "FROM transactions GROUP BY 2, currency, outcome",
+                    (name, size)
+                )
+
+    def plan(self, start, end, granularities=None):
+        """Split [start, end) into the fewest rollup segments that cover it exactly"""
+        if granularities is None:
+            granularities = list(self.GRANULARITIES.items())
+        if start >= end:
+            return []
+
+        name, size = granularities[0]
+        if len(granularities) == 1:
+            return [(name, start, end)]
+
+        aligned_start = -(-start // size) * size
+        aligned_end = end - end % size
+        if aligned_start >= aligned_end:
+            return self.plan(start, end, granularities[1:])
+
+        return (
+            self.plan(start, aligned_start, granularities[1:])
+            + [(name, aligned_start, aligned_end)]
+            + self.plan(aligned_end, end, granularities[1:])
+        )
+
+    def query(self, start, end):
+        """Totals by currency and outcome for [start, end), to one-minute resolution"""
+        minute = self.GRANULARITIES["minute"]
+        start = int(start) - int(start) % minute
+        end = -(-int(end) // minute) * minute
+
+        totals = {}
+        with self.lock:
+            for name, seg_start, seg_end in self.plan(start, end):
+                rows = self.conn.execute(
+                    "SELECT currency, outcome, SUM(count), SUM(amount) FROM rollups "
+                    "WHERE granularity = ? AND bucket >= ? AND bucket < ? "
+                    "GROUP BY currency, outcome",
+                    (name, seg_start, seg_end)
+                ).fetchall()
+                for currency, outcome, count, amount in rows:
+                    entry = totals.setdefault(currency, {}).setdefault(outcome, {"count": 0, "amount": 0.0})
+                    entry["count"] += count
+                    entry["amount"] += amount
+
+        return {"start": start, "end": end, "totals": totals}
+
+    def series(self, start, end, granularity):
+        """Per-bucket rows for [start, end) read from a single rollup level"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT bucket, currency, outcome, count, amount FROM rollups "
+                "WHERE granularity = ? AND bucket >= ? AND bucket < ? "
+                "ORDER BY bucket, currency, outcome",
+                (granularity, int(start), int(end))
+            ).fetchall()
+
+        return [
+            {"bucket": bucket, "currency": currency, "outcome": outcome, "count": count, "amount": amount}
+            for bucket, currency, outcome, count, amount in rows
+        ]
+
+class InviteLinkTracker:
+    """Indexed invite-link-to-transaction table for join tracking and revocation"""
+
+    def __init__(self, db_path=DATABASE_PATH):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS invite_links (
+                id INTEGER PRIMARY KEY,
+                transaction_id TEXT,
+                user_id TEXT,
+                invite_link TEXT UNIQUE,
+                created_at INTEGER,
+                expires_at INTEGER,
+                joined_at INTEGER,
+                joined_user_id TEXT,
+                revoked_at INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_invite_links_transaction_id ON invite_links (transaction_id);
+            CREATE INDEX IF NOT EXISTS idx_invite_links_user_id ON invite_links (user_id);
+            CREATE INDEX IF NOT EXISTS idx_invite_links_pending ON invite_links (expires_at)
+                WHERE invite_link IS NOT NULL AND revoked_at IS NULL;
+        """)
+        self.conn.commit()
+
+    def record(self, transaction_id, user_id, invite_link, created_at=None):
+        """Remember a paid transaction and the invite link sent for it (None if link creation failed).
+        A retried fulfillment adds a row for its new link; earlier links stay tracked until revoked."""
+        created_at = int(created_at if created_at is not None else time.time())
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO invite_links (transaction_id, user_id, invite_link, created_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (str(transaction_id), str(user_id), invite_link, created_at, created_at + INVITE_LINK_TTL)
+            )
+
+    def mark_joined(self, invite_link, joined_user_id, joined_at):
+        """Record a join through a tracked link; returns its transaction ID"""
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT id, transaction_id, user_id FROM invite_links WHERE invite_link = ? AND joined_at IS NULL",
+                (invite_link,)
+            ).fetchone()
+            if not row:
+                return None
+            self.conn.execute(
+                "UPDATE invite_links SET joined_at = ?, joined_user_id = ? WHERE id = ?",
+                (int(joined_at), str(joined_user_id), row[0])
+            )
+        if row[2] != str(joined_user_id):
+            logger.warning(f"Invite link for user {row[2]} was used by user {joined_user_id}")
+        return row[1]
+
+    def mark_joined_by_user(self, user_id, joined_at):
+        """Record a join without a visible link (e.g. approved request) against the user's latest link"""
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT id, transaction_id FROM invite_links WHERE user_id = ? AND joined_at IS NULL "
+                "ORDER BY created_at DESC, id DESC LIMIT 1",
+                (str(user_id),)
+            ).fetchone()
+            if not row:
+                return None
+            self.conn.execute(
+                "UPDATE invite_links SET joined_at = ?, joined_user_id = ? WHERE id = ?",
+                (int(joined_at), str(user_id), row[0])
+            )
+        return row[1]
+
+    def is_paid_user(self, user_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM invite_links WHERE user_id = ? LIMIT 1", (str(user_id),)
+            ).fetchone()
+        return row is not None
+
+    def links_to_revoke(self, now, limit):
+        """Unrevoked links that were used or have expired, oldest first"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT invite_link FROM invite_links "
+                "WHERE invite_link IS NOT NULL AND revoked_at IS NULL AND (joined_at IS NOT NULL OR expires_at <= ?) "
+                "ORDER BY expires_at LIMIT ?",
+                (int(now), limit)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def mark_revoked(self, invite_links, revoked_at):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE invite_links SET revoked_at = ? WHERE invite_link = ?",
+                [(int(revoked_at), link) for link in invite_links]
+            )
+
+    def stats(self, now=None):
+        """Link counts and link-to-join latency percentiles (seconds)"""
+        now = int(now if now is not None else time.time())
+        with self.lock:
+            counts = self.conn.execute(
+                "SELECT "
+                "SUM(invite_link IS NOT NULL AND revoked_at IS NULL AND joined_at IS NULL AND expires_at > ?), "
+                "SUM(joined_at IS NOT NULL), "
+                "SUM(invite_link IS NOT NULL AND revoked_at IS NULL AND joined_at IS NULL AND expires_at <= ?), "
+                "SUM(revoked_at IS NOT NULL), "
+                "COUNT(DISTINCT transaction_id) "
+                "FROM invite_links",
+                (now, now)
+            ).fetchone()
+            joined = counts[1] or 0
+            latency = {}
+            for name, pct in (("p50", 0.5), ("p90", 0.9), ("max", 1.0)):
+                if not joined:
+                    break
+                row = self.conn.execute(
+                    "SELECT joined_at - created_at FROM invite_links WHERE joined_at IS NOT NULL "
+                    "ORDER BY 1 LIMIT 1 OFFSET ?",
+                    (min(joined - 1, int(pct * joined)),)
+                ).fetchone()
+                latency[name] = row[0]
+
+        return {
+            "active": counts[0] or 0,
+            "joined": joined,
+            "expired_unrevoked": counts[2] or 0,
+            "revoked": counts[3] or 0,
+            "transactions": counts[4],
+            "join_latency_seconds": latency
+        }
+
+class HealthMonitor:
+    """Background probes of Telegram and Flutterwave with TTL-cached results"""
+
+    PROBE_TIMEOUT = 5
+
+    def __init__(self, interval=HEALTH_PROBE_INTERVAL, ttl=HEALTH_CACHE_TTL):
+        self.interval = interval
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.results = {}
+        self.costs = {"telegram": {"probes": 0, "total_ms": 0.0}, "flutterwave": {"probes": 0, "total_ms": 0.0}}
+        self.bot_identity = None
+        self.channel = None
+        self.thread = None
+
+    def probe_telegram(self):
+        """Resolve the bot identity with getMe"""
+        if not TELEGRAM_BOT_TOKEN:
+            return False, "TELEGRAM_BOT_TOKEN not set"
+
+        response = http_session.get(f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}/getMe", timeout=self.PROBE_TIMEOUT)
+        response.raise_for_status()
+        result = response.json()
+        if not result.get("ok"):
+            return False, "Invalid bot token"
+
+        bot_info = result["result"]
+        self.bot_identity = {
+            "username": bot_info.get("username"),
+            "name": bot_info.get("first_name"),
+            "id": bot_info.get("id")
+        }
+        return True, "ok"
+
+    def probe_flutterwave(self):
+        """Make a cheap authenticated call to the Flutterwave API"""
+        if not FLUTTERWAVE_SECRET_KEY:
+            return False, "FLUTTERWAVE_SECRET_KEY not set"
+
+        response = http_session.get(
+            f"{FLUTTERWAVE_API_BASE}/v3/banks/NG",
+            headers={"Authorization": f"Bearer {FLUTTERWAVE_SECRET_KEY}"},
+            timeout=self.PROBE_TIMEOUT
+        )
+        response.raise_for_status()
+        return True, "ok"
+
+    def resolve_channel(self):
+        """Look up the configured channel; retried by the probe loop until it succeeds"""
+        if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHANNEL_ID:
+            return None
+
+        try:
+            response = http_session.get(
+                f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}/getChat",
+                params={"chat_id": TELEGRAM_CHANNEL_ID},
+                timeout=self.PROBE_TIMEOUT
+            )
+            response.raise_for_status()
+            result = response.json()
+            if result.get("ok") and result["result"].get("id") is not None:
+                chat = result["result"]
+                self.channel = {"id": chat.get("id"), "title": chat.get("title"), "type": chat.get("type")}
+            else:
+                logger.error(f"Failed to resolve channel {TELEGRAM_CHANNEL_ID}: {result}")
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"Failed to resolve channel {TELEGRAM_CHANNEL_ID}: {e}")
+
+        return self.channel
+
+    def run_probe(self, name):
+        """Run one probe and cache its result"""
+        probe = getattr(self, f"probe_{name}")
+        started = time.perf_counter()
+        try:
+            ok, detail = probe()
+        except (requests.RequestException, ValueError) as e:
+            ok, detail = False, str(e)
+        latency_ms = (time.perf_counter() - started) * 1000
+
+        result = {"ok": ok, "detail": detail, "latency_ms": round(latency_ms, 2), "checked_at": time.time()}
+        with self.lock:
+            self.results[name] = result
+            self.costs[name]["probes"] += 1
+            self.costs[name]["total_ms"] += latency_ms
+        return result
+
+    def run_all(self):
+        for name in self.costs:
+            self.run_probe(name)
+        if self.channel is None:
+            self.resolve_channel()
+
+    def get(self, name):
+        """Cached probe result, refreshed synchronously if missing or expired"""
+        with self.lock:
+            result = self.results.get(name)
+        if result is None or time.time() - result["checked_at"] > self.ttl:
+            result = self.run_probe(name)
+        return result
+
+    def start(self):
+        """Start the background probe loop (once per process)"""
+        if self.thread and self.thread.is_alive():
+            return
+
+        def loop():
+            while True:
+                # Probe straight away if the startup warm-up was skipped
+                if self.results:
+                    time.sleep(self.interval)
+                self.run_all()
+
+        self.thread = threading.Thread(target=loop, name="health-monitor", daemon=True)
+        self.thread.start()
+
+    def snapshot(self):
+        """Cached results with staleness, without touching the network"""
+        now = time.time()
+        checks = {}
+        with self.lock:
+            for name, cost in self.costs.items():
+                result = self.results.get(name)
+                if result is None:
+                    checks[name] = {"ok": False, "detail": "not probed yet"}
+                    continue
+                age = now - result["checked_at"]
+                checks[name] = dict(result, age_seconds=round(age, 1), stale=age > self.ttl)
+                checks[name]["avg_probe_ms"] = round(cost["total_ms"] / cost["probes"], 2)
+                checks[name]["probes"] = cost["probes"]
+
+        healthy = all(check["ok"] and not check.get("stale") for check in checks.values())
+        return healthy, checks
+
+class WebhookRecorder:
+    """Opt-in append-only capture of inbound webhooks (one compact JSON line each)"""
+
+    CAPTURED_ENDPOINTS = {"telegram_webhook", "flutterwave_webhook"}
+    KEPT_HEADERS = {"content-type", "user-agent", "verif-hash", "x-telegram-bot-api-secret-token"}
+    SECRET_HEADERS = {"verif-hash", "x-telegram-bot-api-secret-token"}
+    REDACTED_KEYS = {
+        "email", "phone_number", "name", "fullname", "first_name", "last_name", "username",
+        "telegram_username", "bio", "customer", "card", "account_id", "ip", "device_fingerprint"
+    }
+    FREE_TEXT_KEYS = {"text", "caption"}
+    REDACTED = "[REDACTED]"
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "a", buffering=1, encoding="utf-8")
+
+    def redact(self, value, key=None):
+        """Strip personal data while keeping the shape the handlers depend on"""
+        if key in self.REDACTED_KEYS:
+            return self.REDACTED
+        if isinstance(value, dict):
+            return {k: self.redact(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.redact(v) for v in value]
+        if key in self.FREE_TEXT_KEYS and isinstance(value, str) and not value.startswith("/"):
+            return self.REDACTED
+        if key == "invite_link" and isinstance(value, str):
+            # Live join URL: keep a stable placeholder so replays still see a matching link
+            return "https://t.me/+" + hashlib.sha256(value.encode()).hexdigest()[:16]
+        return value
+
+    def record(self, path, headers, body, started_at, duration_ms, status):
+        headers = {
+            k.lower(): (self.REDACTED if k.lower() in self.SECRET_HEADERS else v)
+            for k, v in headers.items() if k.lower() in self.KEPT_HEADERS
+        }
+        try:
+            body = self.redact(json.loads(body))
+        except ValueError:
+            body = None
+
+        line = json.dumps({
+            "t": round(started_at, 6),
+            "path": path,
+            "headers": headers,
+            "body": body,
+            "duration_ms": round(duration_ms, 3),
+            "status": status
+        }, separators=(",", ":"), ensure_ascii=False)
+
+        with self.lock:
+            self.file.write(line + "\n")
+
+class RequestProfiler:
+    """Sampling profiler and per-stage span timing for a bounded window"""
+
+    MAX_DURATION = 300
+    NULL_SPAN = contextlib.nullcontext()
+
+    def __init__(self):
+        self.active = False
+        self.lock = threading.Lock()
+        self.thread = None
+        self.request_threads = set()
+        self.reset()
+
+    def reset(self):
+        self.stacks = {}
+        self.stages = {}
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+        self.interval = None
+
+    def start(self, duration, interval):
+        """Begin profiling; returns False if a window is already running"""
+        with self.lock:
+            if self.active:
+                return False
+            self.reset()
+            self.interval = interval
+            self.started_at = time.time()
+            self.deadline = time.monotonic() + min(duration, self.MAX_DURATION)
+            self.active = True
+
+        self.thread = threading.Thread(target=self.sample_loop, name="request-profiler", daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        with self.lock:
+            if self.active:
+                self.active = False
+                self.stopped_at = time.time()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def sample_loop(self):
+        """Sample the stacks of threads that are serving requests"""
+        while self.active and time.monotonic() < self.deadline:
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id in self.request_threads:
+                    frame = frames.get(thread_id)
+                    if frame is None:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    key = ";".join(reversed(stack))
+                    self.stacks[key] = self.stacks.get(key, 0) + 1
+                    self.samples += 1
+            time.sleep(self.interval)
+
+        self.stop()
+
+    def enter_request(self):
+        if self.active:
+            with self.lock:
+                self.request_threads.add(threading.get_ident())
+
+    def exit_request(self):
+        with self.lock:
+            self.request_threads.discard(threading.get_ident())
+
+    def span(self, name):
+        """Time a stage of the request path; a shared no-op while disabled"""
+        if not self.active:
+            return self.NULL_SPAN
+        return self.timed(name)
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(name, (time.perf_counter() - started) * 1000)
+
+    def record_stage(self, name, elapsed_ms):
+        with self.lock:
+            stats = self.stages.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            stats["count"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+    def collapsed(self):
+        """Stacks in collapsed format (flamegraph.pl, speedscope, inferno)"""
+        with self.lock:
+            return "\n".join(f"{stack} {count}" for stack, count in sorted(self.stacks.items()))
+
+    def report(self):
+        with self.lock:
+            stages = {
+                name: dict(
+                    stats,
+                    total_ms=round(stats["total_ms"], 3),
+                    max_ms=round(stats["max_ms"], 3),
+                    avg_ms=round(stats["total_ms"] / stats["count"], 3)
+                )
+                for name, stats in sorted(self.stages.items())
+            }
+            return {
+                "active": self.active,
+                "started_at": self.started_at,
+                "stopped_at": self.stopped_at,
+                "interval_ms": self.interval * 1000 if self.interval else None,
+                "samples": self.samples,
+                "unique_stacks": len(self.stacks),
+                "stages": stages
+            }
+
+class SQLiteSharedState:
+    """Lease store shared by processes on one host"""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, expires_at REAL) WITHOUT ROWID"
+        )
+
+    def acquire(self, name, owner, ttl):
+        """Take the lease if it is free or expired, or renew it if we hold it"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self.conn.execute(
+                    "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                    "WHERE leases.owner = excluded.owner OR leases.expires_at <= ?",
+                    (name, owner, now + ttl, now)
+                )
+                self.conn.execute("COMMIT")
+            except sqlite3.Error:
+                self.conn.execute("ROLLBACK")
+                raise
+        return cursor.rowcount == 1
+
+    def release(self, name, owner):
+        with self.lock:
+            self.conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def get(self, name):
+        """Current owner of a live lease, or None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT owner FROM leases WHERE name = ? AND expires_at > ?", (name, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def purge_expired(self):
+        """Delete expired lease rows; returns how many were removed"""
+        with self.lock:
+            cursor = self.conn.execute("DELETE FROM leases WHERE expires_at <= ?", (time.time(),))
+        return cursor.rowcount
+
+class RedisSharedState:
+    """Lease store on any Redis-protocol server (SET NX PX, WATCH/MULTI/EXEC)"""
+
+    def __init__(self, url):
+        parsed = urlparse(url)
+        self.address = (parsed.hostname or "127.0.0.1", parsed.port or 6379)
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.password = parsed.password
+        self.lock = threading.Lock()
+        self.sock = None
+
+    def connect(self):
+        self.sock = socket.create_connection(self.address, timeout=5)
+        self.reader = self.sock.makefile("rb")
+        if self.password:
+            self.send("AUTH", self.password)
+        if self.db:
+            self.send("SELECT", self.db)
+
+    def read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RuntimeError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length == -1:
+                return None
+            data = self.reader.read(length + 2)[:-2]
+            return data.decode()
+        if kind == b"*":
+            length = int(rest)
+            if length == -1:
+                return None
+            return [self.read_reply() for _ in range(length)]
+        raise RuntimeError(f"Unexpected Redis reply: {line!r}")
+
+    def send(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = str(arg).encode()
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        self.sock.sendall(b"".join(parts))
+        return self.read_reply()
+
+    def command(self, fn):
+        """Run fn under the connection lock, reconnecting once on a dropped connection"""
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    if self.sock is None:
+                        self.connect()
+                    return fn()
+                except (OSError, ConnectionError):
+                    if self.sock:
+                        self.sock.close()
+                    self.sock = None
+                    if attempt:
+                        raise
+
+    def acquire(self, name, owner, ttl):
+        def run():
+            if self.send("SET", name, owner, "NX", "PX", int(ttl * 1000)) == "OK":
+                return True
+            self.send("WATCH", name)
+            if self.send("GET", name) != owner:
+                self.send("UNWATCH")
+                return False
+            self.send("MULTI")
+            self.send("SET", name, owner, "PX", int(ttl * 1000))
+            return self.send("EXEC") is not None
+        return self.command(run)
+
+    def release(self, name, owner):
+        def run():
+            self.send("WATCH", name)
+            if self.send("GET", name) != owner:
+                self.send("UNWATCH")
+                return
+            self.send("MULTI")
+            self.send("DEL", name)
+            self.send("EXEC")
+        self.command(run)
+
+    def get(self, name):
+        return self.command(lambda: self.send("GET", name))
+
+    def purge_expired(self):
+        """Redis expires keys itself"""
+        return 0
+
+def make_shared_state(url):
+    """Pick the shared-state backend from SHARED_STATE_URL (sqlite:///path or redis://host:port/db)"""
+    if url.startswith("redis://"):
+        return RedisSharedState(url)
+    if url.startswith("sqlite:///"):
+        return SQLiteSharedState(url[len("sqlite:///"):])
+    raise ValueError(f"Unsupported SHARED_STATE_URL: {url}")
+
+class ClusterCoordinator:
+    """Leader election and per-user/transaction ownership via leases"""
+
+    # How long a claimed transaction stays owned while being fulfilled, and how long
+    # a fulfilled transaction is remembered
+    PROCESSING_TTL = 120
+    COMPLETED_TTL = 30 * 24 * 60 * 60
+
+    def __init__(self, state, node_id=NODE_ID, lease_ttl=LEASE_TTL):
+        self.state = state
+        self.node_id = node_id
+        self.lease_ttl = lease_ttl
+        self.is_leader = False
+        self.jobs = {}
+        self.heartbeat_thread = None
+        self.jobs_thread = None
+        self.stopped = threading.Event()
+
+    def register_job(self, name, interval, fn):
+        """Run fn every interval seconds, on the leader only"""
+        self.jobs[name] = {"interval": interval, "fn": fn, "last_run": 0.0}
+
+    def heartbeat(self):
+        """Take or renew leadership; returns whether this node is the leader"""
+        was_leader = self.is_leader
+        self.is_leader = self.state.acquire("leader", self.node_id, self.lease_ttl)
+        if self.is_leader != was_leader:
+            logger.info(f"Node {self.node_id} {'became' if self.is_leader else 'lost'} leader")
+        return self.is_leader
+
+    def run_jobs(self):
+        """Run due leader jobs, stopping as soon as leadership is lost"""
+        now = time.time()
+        for name, job in list(self.jobs.items()):
+            if not self.is_leader or self.stopped.is_set():
+                return
+            if now - job["last_run"] >= job["interval"]:
+                job["last_run"] = now
+                try:
+                    job["fn"]()
+                except Exception as e:
+                    logger.error(f"Leader job {name} failed: {e}")
+
+    def start(self):
+        """Renew the leader lease and run leader jobs on separate threads, so a
+        long job never lets the lease lapse"""
+        if self.heartbeat_thread and self.heartbeat_thread.is_alive():
+            return
+
+        def heartbeat_loop():
+            while not self.stopped.is_set():
+                try:
+                    self.heartbeat()
+                except Exception as e:
+                    self.is_leader = False
+                    logger.error(f"Cluster heartbeat failed: {e}")
+                self.stopped.wait(self.lease_ttl / 3)
+
+        def jobs_loop():
+            while not self.stopped.wait(self.lease_ttl / 3):
+                self.run_jobs()
+
+        self.heartbeat_thread = threading.Thread(target=heartbeat_loop, name="cluster-heartbeat", daemon=True)
+        self.jobs_thread = threading.Thread(target=jobs_loop, name="cluster-jobs", daemon=True)
+        self.heartbeat_thread.start()
+        self.jobs_thread.start()
+
+    def stop(self):
+        """Stop the heartbeat and hand over leadership immediately"""
+        self.stopped.set()
+        # Let an in-flight renewal finish so it cannot re-take the lease after the release
+        if self.heartbeat_thread and self.heartbeat_thread is not threading.current_thread():
+            self.heartbeat_thread.join()
+        if self.is_leader:
+            self.state.release("leader", self.node_id)
+            self.is_leader = False
+
+    def token(self):
+        """Per-claim lease owner, so a node never re-acquires work it already claimed"""
+        return f"{self.node_id}:{uuid.uuid4().hex}"
+
+    def acquire_user(self, user_id, wait=5.0):
+        """Take exclusive ownership of a user's fulfillment, waiting briefly if it is held.
+        Returns the lease token, or None on timeout."""
+        token = self.token()
+        deadline = time.monotonic() + wait
+        while not self.state.acquire(f"user:{user_id}", token, self.PROCESSING_TTL):
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.1)
+        return token
+
+    def release_user(self, user_id, token):
+        self.state.release(f"user:{user_id}", token)
+
+    def is_transaction_done(self, transaction_id):
+        return self.state.get(f"done:{transaction_id}") is not None
+
+    def claim_transaction(self, transaction_id):
+        """Token if this node should fulfill the transaction, None if it is done or in progress"""
+        if self.is_transaction_done(transaction_id):
+            return None
+        token = self.token()
+        if not self.state.acquire(f"tx:{transaction_id}", token, self.PROCESSING_TTL):
+            return None
+        # Another node may have completed it between the check and the claim
+        if self.is_transaction_done(transaction_id):
+            self.release_transaction(transaction_id, token)
+            return None
+        return token
+
+    def complete_transaction(self, transaction_id, token):
+        """Mark the transaction done, then drop the processing lease"""
+        self.state.acquire(f"done:{transaction_id}", token, self.COMPLETED_TTL)
+        self.release_transaction(transaction_id, token)
+
+    def release_transaction(self, transaction_id, token):
+        self.state.release(f"tx:{transaction_id}", token)
+
+def admin_required(view):
+    """Protect an endpoint with the ADMIN_API_TOKEN (X-Admin-Token header)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = request.headers.get('X-Admin-Token', '')
+        if not ADMIN_API_TOKEN or not hmac.compare_digest(token, ADMIN_API_TOKEN):
+            return jsonify({"error": "Unauthorized"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
 # Initialize the payment bot
 payment_bot = FlutterwavePaymentBot()
+analytics = PaymentAnalytics()
+health_monitor = HealthMonitor()
+profiler = RequestProfiler()
+cluster = ClusterCoordinator(make_shared_state(SHARED_STATE_URL))
+invite_tracker = InviteLinkTracker()
+
+def sweep_invite_links(now=None):
+    """Revoke used and expired invite links in batches (leader only)"""
+    now = now if now is not None else time.time()
+    revoked = 0
+    while True:
+        # A sweep can outlast the lease; never keep revoking after another node took over
+        if not cluster.heartbeat():
+            logger.warning("Not the leader (any more), stopping invite link sweep")
+            break
+        batch = invite_tracker.links_to_revoke(now, INVITE_REVOKE_BATCH)
+        done = [link for link in batch if payment_bot.revoke_invite_link(link)]
+        invite_tracker.mark_revoked(done, time.time())
+        revoked += len(done)
+        # Stop when drained, or when Telegram failures leave the batch unchanged
+        if len(batch) < INVITE_REVOKE_BATCH or len(done) < len(batch):
+            break
+    if revoked:
+        logger.info(f"Revoked {revoked} invite links")
+    return revoked
+
+cluster.register_job("revoke_invite_links", INVITE_SWEEP_INTERVAL, sweep_invite_links)
+cluster.register_job("purge_expired_leases", 60 * 60, cluster.state.purge_expired)
+startup_report = {"warmup_ms": None, "missing_config": [], "time_to_first_request_ms": None}
+
+def startup():
+    """Validate config, resolve bot identity and channel, and pre-warm HTTP pools"""
+    started = time.perf_counter()
+
+    required = {
+        "FLUTTERWAVE_SECRET_KEY": FLUTTERWAVE_SECRET_KEY,
+        "FLUTTERWAVE_WEBHOOK_SECRET": FLUTTERWAVE_WEBHOOK_SECRET,
+        "TELEGRAM_BOT_TOKEN": TELEGRAM_BOT_TOKEN,
+        "TELEGRAM_CHANNEL_ID": TELEGRAM_CHANNEL_ID
+    }
+    startup_report["missing_config"] = [name for name, value in required.items() if not value]
+    for name in startup_report["missing_config"]:
+        logger.warning(f"{name} is not set")
+
+    # The first probes open the pooled connections to both upstreams
+    health_monitor.run_all()
+
+    startup_report["warmup_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    logger.info(f"Startup warm-up finished in {startup_report['warmup_ms']} ms "
+                f"(bot: {health_monitor.bot_identity}, channel: {health_monitor.channel})")
+
+if STARTUP_WARMUP:
+    startup()
+
+# Background probes and the leader heartbeat run whether or not the warm-up ran
+health_monitor.start()
+cluster.start()
+
+@app.before_request
+def record_first_request():
+    """Measure time from process start to the first request served"""
+    if startup_report["time_to_first_request_ms"] is None:
+        startup_report["time_to_first_request_ms"] = round((time.time() - PROCESS_STARTED_AT) * 1000, 2)
+        logger.info(f"Time to first request: {startup_report['time_to_first_request_ms']} ms")
+
+@app.before_request
+def start_request_profiling():
+    if profiler.active:
+        profiler.enter_request()
+        g.profile_started = time.perf_counter()
+
+@app.teardown_request
+def finish_request_profiling(exc):
+    if "profile_started" in g:
+        profiler.record_stage(f"request:{request.endpoint}", (time.perf_counter() - g.profile_started) * 1000)
+        profiler.exit_request()
+
+webhook_recorder = WebhookRecorder(WEBHOOK_CAPTURE_PATH) if WEBHOOK_CAPTURE_PATH else None
+
+@app.before_request
+def start_webhook_capture():
+    if webhook_recorder and request.endpoint in WebhookRecorder.CAPTURED_ENDPOINTS:
+        g.capture_started = (time.time(), time.perf_counter())
+
+@app.after_request
+def finish_webhook_capture(response):
+    """Append the inbound webhook to the capture file when capture is enabled"""
+    if webhook_recorder and "capture_started" in g:
+        started_at, started = g.capture_started
+        try:
+            webhook_recorder.record(
+                request.path,
+                request.headers,
+                request.get_data(),
+                started_at,
+                (time.perf_counter() - started) * 1000,
+                response.status_code
+            )
+        except (OSError, TypeError) as e:
+            logger.error(f"Failed to capture webhook: {e}")
+    return response
 
 @app.route('/', methods=['GET'])
 def home():
@@ -199,7 +1295,10 @@ def home():
             "create_payment": "/create-payment",
             "payment_form": "/payment-form",
             "health": "/health",
-            "test_telegram": "/test-telegram"
+            "deep_health": "/health/deep",
+            "test_telegram": "/test-telegram",
+            "analytics": "/admin/analytics",
+            "invite_links": "/admin/invite-links"
         }
     })
 
@@ -212,43 +1311,48 @@ def health_check():
         "timestamp": time.time()
     })
 
+@app.route('/health/deep', methods=['GET'])
+def deep_health_check():
+    """Deep health check served from cached background probes"""
+    healthy, checks = health_monitor.snapshot()
+    return jsonify({
+        "status": "healthy" if healthy else "unhealthy",
+        "checks": checks,
+        "bot": health_monitor.bot_identity,
+        "channel": health_monitor.channel,
+        "startup": startup_report,
+        "timestamp": time.time()
+    }), 200 if healthy else 503
+
 @app.route('/test-telegram', methods=['GET'])
 def test_telegram():
     """Test Telegram bot connection"""
     if not TELEGRAM_BOT_TOKEN:
         return jsonify({"error": "TELEGRAM_BOT_TOKEN not set"})
     
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getMe"
-    
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        result = response.json()
-        
-        if result.get("ok"):
-            bot_info = result["result"]
-            return jsonify({
-                "status": "Telegram connection successful!",
-                "bot_info": {
-                    "username": bot_info.get("username"),
-                    "name": bot_info.get("first_name"),
-                    "id": bot_info.get("id")
-                }
-            })
-        else:
-            return jsonify({"error": "Invalid bot token"})
-            
-    except requests.RequestException as e:
-        return jsonify({"error": f"Connection failed: {str(e)}"})
+    result = health_monitor.get("telegram")
+    if result["ok"]:
+        return jsonify({
+            "status": "Telegram connection successful!",
+            "bot_info": health_monitor.bot_identity,
+            "checked_at": result["checked_at"]
+        })
+    elif result["detail"] == "Invalid bot token":
+        return jsonify({"error": "Invalid bot token"})
+    else:
+        return jsonify({"error": f"Connection failed: {result['detail']}"})
 
 @app.route('/webhook/telegram', methods=['POST'])
 def telegram_webhook():
     """Handle incoming Telegram messages"""
     try:
-        update_data = request.get_json()
-        logger.info(f"Telegram webhook received: {update_data}")
+        with profiler.span("json_parse"):
+            update_data = request.get_json()
+        with profiler.span("logging"):
+            logger.info(f"Telegram webhook received: {update_data}")
         
-        payment_bot.process_telegram_update(update_data)
+        with profiler.span("process_telegram_update"):
+            payment_bot.process_telegram_update(update_data)
         
         return jsonify({"status": "ok"})
         
@@ -264,17 +1368,22 @@ def flutterwave_webhook():
     signature = request.headers.get('verif-hash')
     payload = request.get_data()
     
-    logger.info("Flutterwave webhook received!")
-    logger.info(f"Headers: {dict(request.headers)}")
+    with profiler.span("logging"):
+        logger.info("Flutterwave webhook received!")
+        logger.info(f"Headers: {dict(request.headers)}")
     
     # Verify webhook signature (skip if no secret set for testing)
-    if FLUTTERWAVE_WEBHOOK_SECRET and not payment_bot.verify_webhook_signature(payload, signature):
+    with profiler.span("hmac"):
+        signature_ok = not FLUTTERWAVE_WEBHOOK_SECRET or payment_bot.verify_webhook_signature(payload, signature)
+    if not signature_ok:
         logger.warning("Invalid webhook signature")
         return jsonify({"error": "Invalid signature"}), 400
     
     try:
-        data = request.get_json()
-        logger.info(f"Webhook data: {data}")
+        with profiler.span("json_parse"):
+            data = request.get_json()
+        with profiler.span("logging"):
+            logger.info(f"Webhook data: {data}")
         
         # Check if this is a successful payment
         if data.get('event') == 'charge.completed' and data.get('data', {}).get('status') == 'successful':
@@ -290,12 +1399,40 @@ def flutterwave_webhook():
             
             logger.info(f"Processing payment for user {user_id}, amount: {amount} {currency}")
             
+            # Without an ID the payment can neither be deduplicated nor claimed
+            if transaction_id is None:
+                logger.warning("No transaction ID found in payment data")
+                return jsonify({"status": "error", "message": "No transaction ID in payment data"}), 400
+            
             if user_id:
-                # Create invite link for the user
-                invite_link = payment_bot.create_invite_link(user_id)
+                # Only one node fulfills a transaction, and one at a time per user
+                transaction_token = cluster.claim_transaction(transaction_id)
+                if not transaction_token:
+                    if cluster.is_transaction_done(transaction_id):
+                        logger.info(f"Transaction {transaction_id} already fulfilled")
+                        return jsonify({"status": "duplicate", "message": "Transaction already processed"})
+                    # Not acknowledged, so Flutterwave retries if the node processing it dies
+                    logger.info(f"Transaction {transaction_id} is being fulfilled elsewhere")
+                    return jsonify({"status": "busy", "message": "Transaction in progress, retry later"}), 503
+                user_token = cluster.acquire_user(user_id)
+                if not user_token:
+                    cluster.release_transaction(transaction_id, transaction_token)
+                    logger.warning(f"User {user_id} is being fulfilled by another node")
+                    return jsonify({"status": "busy", "message": "Retry later"}), 503
+
+                # Release the claim on failure so Flutterwave's retry can fulfill it
+                completed = False
+                try:
+                    # Create invite link for the user
+                    invite_link = payment_bot.create_invite_link(user_id)
                 
-                if invite_link:
-                    welcome_message = f"""
+                    try:
+                        invite_tracker.record(transaction_id, user_id, invite_link)
+                    except sqlite3.Error as e:
+                        logger.error(f"Failed to record invite link for transaction {transaction_id}: {e}")
+                
+                    if invite_link:
+                        welcome_message = f"""
 🎉 <b>PAYMENT SUCCESSFUL!</b> 🎉
 
 ✅ <b>Amount:</b> {amount} {currency}
@@ -317,8 +1454,8 @@ def flutterwave_webhook():
 Thank you for your payment! 🚀
 """
                     
-                    # Also send a simple message with just the link for easy access
-                    simple_link_message = f"""
+                        # Also send a simple message with just the link for easy access
+                        simple_link_message = f"""
 🔗 <b>Quick Access Link:</b>
 
 {invite_link}
@@ -326,8 +1463,8 @@ Thank you for your payment! 🚀
 Tap to join the premium channel instantly!
 """
                     
-                else:
-                    welcome_message = f"""
+                    else:
+                        welcome_message = f"""
 🎉 <b>PAYMENT SUCCESSFUL!</b> 🎉
 
 ✅ <b>Amount:</b> {amount} {currency}
@@ -339,12 +1476,31 @@ Your payment has been confirmed!
 
 We'll manually add you to the channel within 24 hours.
 """
-                    simple_link_message = "Please contact support for manual channel access."
+                        simple_link_message = "Please contact support for manual channel access."
 
-                # Send both messages
-                success1 = payment_bot.send_telegram_message(user_id, welcome_message)
-                time.sleep(1)  # Small delay between messages
-                success2 = payment_bot.send_telegram_message(user_id, simple_link_message)
+                    # Send both messages
+                    success1 = payment_bot.send_telegram_message(user_id, welcome_message)
+                    with profiler.span("delay"):
+                        time.sleep(1)  # Small delay between messages
+                    success2 = payment_bot.send_telegram_message(user_id, simple_link_message)
+
+                    cluster.complete_transaction(transaction_id, transaction_token)
+                    completed = True
+                finally:
+                    if not completed:
+                        cluster.release_transaction(transaction_id, transaction_token)
+                    cluster.release_user(user_id, user_token)
+                
+                if success1 or success2:
+                    outcome = "success" if invite_link else "no_link"
+                else:
+                    outcome = "partial"
+
+                try:
+                    with profiler.span("analytics_record"):
+                        analytics.record(transaction_id, user_id, amount, currency, outcome)
+                except sqlite3.Error as e:
+                    logger.error(f"Failed to record transaction {transaction_id}: {e}")
                 
                 if success1 or success2:
                     logger.info(f"Payment processed and user {user_id} notified")
@@ -362,6 +1518,75 @@ We'll manually add you to the channel within 24 hours.
         logger.error(f"Error processing webhook: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
+@app.route('/admin/analytics', methods=['GET'])
+@admin_required
+def admin_analytics():
+    """Revenue and fulfillment totals for a time range, served from rollups"""
+    try:
+        end = int(request.args.get('end', time.time()))
+        start = int(request.args.get('start', end - 86400))
+    except ValueError:
+        return jsonify({"error": "start and end must be unix timestamps"}), 400
+
+    granularity = request.args.get('granularity')
+    if granularity and granularity not in PaymentAnalytics.GRANULARITIES:
+        return jsonify({"error": f"granularity must be one of {', '.join(PaymentAnalytics.GRANULARITIES)}"}), 400
+
+    if granularity:
+        # Widen the range to whole buckets so the series and the totals cover the same span
+        size = PaymentAnalytics.GRANULARITIES[granularity]
+        start, end = start - start % size, -(-end // size) * size
+
+    result = analytics.query(start, end)
+    if granularity:
+        result["series"] = analytics.series(result["start"], result["end"], granularity)
+
+    return jsonify(result)
+
+@app.route('/admin/profiling/start', methods=['POST'])
+@admin_required
+def start_profiling():
+    """Start sampling and span timing for a bounded window"""
+    options = request.get_json(silent=True) or {}
+    try:
+        duration = float(options.get('duration', 60))
+        interval_ms = float(options.get('interval_ms', 10))
+    except (TypeError, ValueError):
+        return jsonify({"error": "duration and interval_ms must be numbers"}), 400
+
+    if duration <= 0 or interval_ms < 1:
+        return jsonify({"error": "duration must be positive and interval_ms at least 1"}), 400
+
+    if not profiler.start(duration, interval_ms / 1000):
+        return jsonify({"error": "Profiling already running"}), 409
+
+    return jsonify({
+        "status": "started",
+        "duration": min(duration, RequestProfiler.MAX_DURATION),
+        "interval_ms": interval_ms
+    })
+
+@app.route('/admin/profiling/stop', methods=['POST'])
+@admin_required
+def stop_profiling():
+    """Stop profiling early and return the report"""
+    profiler.stop()
+    return jsonify(profiler.report())
+
+@app.route('/admin/profiling', methods=['GET'])
+@admin_required
+def profiling_report():
+    """Per-stage timings, or collapsed stacks with ?format=collapsed"""
+    if request.args.get('format') == 'collapsed':
+        return profiler.collapsed(), 200, {"Content-Type": "text/plain; charset=utf-8"}
+    return jsonify(profiler.report())
+
+@app.route('/admin/invite-links', methods=['GET'])
+@admin_required
+def admin_invite_links():
+    """Active invite link count and link-to-join latency"""
+    return jsonify(invite_tracker.stats())
+
 @app.route('/create-payment', methods=['POST'])
 def create_payment():
     """Create a payment link with user metadata"""
@@ -408,10 +1633,11 @@ def create_payment():
             "Content-Type": "application/json"
         }
         
-        response = requests.post(
-            "https://api.flutterwave.com/v3/payments",
+        response = http_session.post(
+            f"{FLUTTERWAVE_API_BASE}/v3/payments",
             json=payment_payload,
-            headers=headers
+            headers=headers,
+            timeout=UPSTREAM_TIMEOUT
         )
         
         if response.status_code == 200:
@@ -0,0 +1,103 @@
+"""Benchmark /admin/analytics range queries over synthetic transactions.
+
+Usage: python bench_analytics.py [--transactions 10000000] [--days 90] [--db bench.db]
+"""
+import os
+import time
+import random
+import argparse
+import statistics
+
+os.environ.setdefault("STARTUP_WARMUP", "false")
+
+from app import PaymentAnalytics
+
+CURRENCIES = ["NGN", "USD", "GHS", "KES"]
+OUTCOMES = ["success", "success", "success", "no_link", "partial"]
+
+
+def load(analytics, count, days, batch_size=100000):
+    """Bulk-insert synthetic transactions spread over the last `days` days"""
+    end = int(time.time())
+    start = end - days * 86400
+    rng = random.Random(42)
+
+    def rows(n, offset):
+        for i in range(n):
+            yield (
+                f"tx_{offset + i}",
+                str(rng.randint(1, 500000)),
+                rng.choice([500, 1000, 2000, 5000]),
+                rng.choice(CURRENCIES),
+                rng.choice(OUTCOMES),
+                rng.randint(start, end - 1)
+            )
+
+    for offset in range(0, count, batch_size):
+        n = min(batch_size, count - offset)
+        with analytics.conn:
+            analytics.conn.executemany(
+                "INSERT INTO transactions (transaction_id, user_id, amount, currency, outcome, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows(n, offset)
+            )
+
+    analytics.rebuild_rollups()
+    return start, end
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--transactions", type=int, default=10_000_000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--db", default="bench_analytics.db")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+
+    analytics = PaymentAnalytics(args.db)
+
+    t0 = time.perf_counter()
+    start, end = load(analytics, args.transactions, args.days)
+    print(f"Loaded {args.transactions:,} transactions and rollups in {time.perf_counter() - t0:.1f}s")
+
+    rng = random.Random(7)
+    ranges = {
+        "last hour": lambda: (end - 3600, end),
+        "today": lambda: (end - end % 86400, end),
+        "random 7 days": lambda: (lambda s: (s, s + 7 * 86400 + 1234))(rng.randint(start, end - 7 * 86400)),
+        f"full {args.days} days": lambda: (start, end),
+    }
+
+    print(f"{'range':<16}{'rollup p50 ms':>15}{'rollup p99 ms':>15}{'raw scan ms':>13}")
+    for label, make_range in ranges.items():
+        rollup = timed(lambda: analytics.query(*make_range()), args.repeat)
+
+        def raw_scan():
+            s, e = make_range()
+            analytics.conn.execute(
+                "SELECT currency, outcome, COUNT(*), SUM(amount) FROM transactions "
+                "WHERE created_at >= ? AND created_at < ? GROUP BY currency, outcome",
+                (s, e)
+            ).fetchall()
+
+        raw = timed(raw_scan, 3)
+        rollup.sort()
+        print(f"{label:<16}{statistics.median(rollup):>15.2f}"
+              f"{rollup[int(len(rollup) * 0.99) - 1]:>15.2f}{statistics.median(raw):>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
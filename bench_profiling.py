@@ -0,0 +1,75 @@
+"""Check that the request profiler costs (almost) nothing while disabled.
+
+Exits non-zero if a disabled span costs more than DISABLED_SPAN_BUDGET_NS or the
+disabled hooks add more than DISABLED_REQUEST_BUDGET of a webhook request's time.
+
+Usage: python bench_profiling.py [--iterations 1000000]
+"""
+import os
+import sys
+import time
+import argparse
+
+os.environ.setdefault("STARTUP_WARMUP", "false")
+os.environ.pop("WEBHOOK_CAPTURE_PATH", None)
+
+import app
+
+DISABLED_SPAN_BUDGET_NS = 1000
+DISABLED_REQUEST_BUDGET = 0.01
+# json_parse, two logging spans, process_telegram_update and two request hooks
+# on the /webhook/telegram path
+CHECKS_PER_REQUEST = 6
+
+UPDATE = {"update_id": 1, "message": {"from": {"id": 1, "first_name": "Bench"}, "text": "/start"}}
+
+
+def per_call_ns(fn, iterations):
+    started = time.perf_counter_ns()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter_ns() - started) / iterations
+
+
+def disabled_span():
+    with app.profiler.span("bench"):
+        pass
+
+
+def bare():
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=1_000_000)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    app.logger.disabled = True
+    app.payment_bot.send_telegram_message = lambda *a, **k: True
+    client = app.app.test_client()
+
+    assert not app.profiler.active
+    span_ns = per_call_ns(disabled_span, args.iterations) - per_call_ns(bare, args.iterations)
+    request_ns = per_call_ns(lambda: client.post("/webhook/telegram", json=UPDATE), args.requests)
+    disabled_share = span_ns * CHECKS_PER_REQUEST / request_ns
+
+    app.profiler.start(duration=60, interval=0.001)
+    enabled_ns = per_call_ns(lambda: client.post("/webhook/telegram", json=UPDATE), args.requests)
+    app.profiler.stop()
+
+    print(f"disabled span:          {span_ns:8.1f} ns (budget {DISABLED_SPAN_BUDGET_NS} ns)")
+    print(f"webhook request:        {request_ns / 1000:8.1f} us disabled, {enabled_ns / 1000:.1f} us enabled")
+    print(f"disabled overhead:      {disabled_share:8.4%} of a request (budget {DISABLED_REQUEST_BUDGET:.0%})")
+    print(f"enabled profiler:       {app.profiler.samples} samples, "
+          f"{len(app.profiler.report()['stages'])} stages")
+
+    if span_ns > DISABLED_SPAN_BUDGET_NS or disabled_share > DISABLED_REQUEST_BUDGET:
+        print("FAIL: disabled profiling overhead is over budget")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
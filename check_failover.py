@@ -0,0 +1,370 @@
+"""Multi-process check: no double fulfillment and leader failover under SIGKILL.
+
+Worker processes share one lease store and all deliver the same Flutterwave
+webhooks to their own app instance (Telegram stubbed), retrying until each
+delivery is acknowledged. The leader is killed mid-run. Every transaction must
+get exactly one completed fulfillment, including the one the leader was in the
+middle of when it was killed, and another node must take over
+leadership. Single-process cases cover a fulfillment that raises and a
+delivery that arrives while the transaction is still being fulfilled.
+
+Usage:
+    python check_failover.py --backend sqlite
+    python check_failover.py --backend redis     # uses a local Redis-protocol stand-in
+    python check_failover.py --backend redis --url redis://127.0.0.1:6379/0
+"""
+import os
+import sys
+import time
+import random
+import re
+import signal
+import argparse
+import tempfile
+import threading
+import subprocess
+import socketserver
+
+from replay_webhooks import StubUpstreamHandler, start_stub
+
+os.environ.setdefault("STARTUP_WARMUP", "false")
+
+
+class StandinRedisHandler(socketserver.StreamRequestHandler):
+    """In-memory subset of Redis: SET NX/PX, GET, DEL, WATCH/MULTI/EXEC"""
+
+    def setup(self):
+        super().setup()
+        self.watched = {}
+        self.queued = None
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2].decode())
+        return args
+
+    def encode(self, value):
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, int):
+            return f":{value}\r\n".encode()
+        if isinstance(value, list):
+            return f"*{len(value)}\r\n".encode() + b"".join(self.encode(v) for v in value)
+        if isinstance(value, tuple):
+            return f"+{value[0]}\r\n".encode()
+        data = value.encode()
+        return f"${len(data)}\r\n".encode() + data + b"\r\n"
+
+    def live(self, key):
+        entry = self.server.data.get(key)
+        if entry and entry[1] is not None and entry[1] <= time.time():
+            del self.server.data[key]
+            self.server.versions[key] = self.server.versions.get(key, 0) + 1
+            return None
+        return entry
+
+    def execute(self, args):
+        name = args[0].upper()
+        data, versions = self.server.data, self.server.versions
+        if name == "SET":
+            key, value, options = args[1], args[2], [a.upper() for a in args[3:]]
+            exists = self.live(key) is not None
+            if ("NX" in options and exists) or ("XX" in options and not exists):
+                return None
+            expires = None
+            if "PX" in options:
+                expires = time.time() + int(options[options.index("PX") + 1]) / 1000
+            data[key] = (value, expires)
+            versions[key] = versions.get(key, 0) + 1
+            return ("OK",)
+        if name == "GET":
+            entry = self.live(args[1])
+            return entry[0] if entry else None
+        if name == "DEL":
+            removed = 0
+            for key in args[1:]:
+                if self.live(key) is not None:
+                    del data[key]
+                    versions[key] = versions.get(key, 0) + 1
+                    removed += 1
+            return removed
+        if name in ("PING", "AUTH", "SELECT"):
+            return ("OK",) if name != "PING" else ("PONG",)
+        raise ValueError(f"unsupported command {name}")
+
+    def handle(self):
+        while True:
+            try:
+                args = self.read_command()
+            except ConnectionError:
+                return
+            if args is None:
+                return
+            name = args[0].upper()
+            with self.server.lock:
+                if name == "WATCH":
+                    for key in args[1:]:
+                        self.live(key)
+                        self.watched[key] = self.server.versions.get(key, 0)
+                    reply = ("OK",)
+                elif name == "UNWATCH":
+                    self.watched = {}
+                    reply = ("OK",)
+                elif name == "MULTI":
+                    self.queued = []
+                    reply = ("OK",)
+                elif name == "EXEC":
+                    for key in self.watched:
+                        self.live(key)
+                    clean = all(self.server.versions.get(k, 0) == v for k, v in self.watched.items())
+                    reply = [self.execute(cmd) for cmd in self.queued] if clean else None
+                    if reply is None:
+                        self.wfile.write(b"*-1\r\n")
+                        reply = False
+                    self.queued, self.watched = None, {}
+                elif self.queued is not None:
+                    self.queued.append(args)
+                    reply = ("QUEUED",)
+                else:
+                    reply = self.execute(args)
+            if reply is not False:
+                self.wfile.write(self.encode(reply))
+
+
+def start_standin():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), StandinRedisHandler)
+    server.daemon_threads = True
+    server.data, server.versions, server.lock = {}, {}, threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def payment(transaction_id, user_id):
+    return {
+        "event": "charge.completed",
+        "data": {"id": transaction_id, "status": "successful", "amount": 1000, "currency": "NGN",
+                 "meta": {"telegram_user_id": str(user_id)}},
+    }
+
+
+def app_env(stub_url, url, database_path):
+    """Environment for an app instance that talks to the stub and the shared lease store"""
+    env = dict(
+        os.environ,
+        STARTUP_WARMUP="false",
+        TELEGRAM_API_BASE=stub_url,
+        FLUTTERWAVE_API_BASE=stub_url,
+        TELEGRAM_BOT_TOKEN="stub-token",
+        TELEGRAM_CHANNEL_ID="-1001",
+        SHARED_STATE_URL=url,
+        DATABASE_PATH=database_path,
+    )
+    env.pop("FLUTTERWAVE_WEBHOOK_SECRET", None)
+    env.pop("WEBHOOK_CAPTURE_PATH", None)
+    return env
+
+
+def worker(args):
+    """One node: heartbeat/leader job plus webhook deliveries retried until acknowledged"""
+    import app
+
+    app.logger.disabled = True
+    app.ClusterCoordinator.PROCESSING_TTL = args.processing_ttl
+    log = os.open(args.log, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+
+    def write(line):
+        os.write(log, f"{line}\n".encode())
+
+    app.cluster.register_job("leader-mark", 0, lambda: write(f"leader {app.cluster.node_id} {time.time()}"))
+
+    client = app.app.test_client()
+    pending = list(range(args.transactions))
+    random.Random(args.worker).shuffle(pending)
+    deadline = time.time() + args.duration
+    while pending and time.time() < deadline:
+        retry = []
+        for transaction_id in pending:
+            response = client.post("/webhook/flutterwave", json=payment(transaction_id, 100 + transaction_id % 7))
+            if response.status_code != 200:
+                retry.append(transaction_id)
+        pending = retry
+        time.sleep(0.2)
+    write(f"finished {app.cluster.node_id} {len(pending)}")
+
+
+def in_flight(calls):
+    """Transactions whose welcome message went out but whose quick-access message did not"""
+    welcomed, finished = {}, set()
+    for path, body in list(calls):
+        if not path.endswith("/sendMessage"):
+            continue
+        match = re.search(r"Transaction ID:</b> (\d+)", body["text"])
+        link = re.search(r"https://t\.me/\+stub\d+", body["text"])
+        if match and link:
+            welcomed[link.group(0)] = int(match.group(1))
+        elif link:
+            finished.add(link.group(0))
+    return {tx for link, tx in welcomed.items() if link not in finished}
+
+
+def single_process_cases(stub_url, url, workdir):
+    """Fulfillment that raises, and a delivery that arrives mid-fulfillment"""
+    os.environ.update(app_env(stub_url, url, os.path.join(workdir, "cases.db")))
+    import app
+
+    app.logger.disabled = True
+    # This process is not one of the nodes; keep it out of the leader election
+    app.cluster.stop()
+    client = app.app.test_client()
+    failures = []
+
+    # A malformed createChatInviteLink reply makes fulfillment raise
+    StubUpstreamHandler.broken_methods = {"createChatInviteLink"}
+    status = client.post("/webhook/flutterwave", json=payment(9001, 501)).status_code
+    StubUpstreamHandler.broken_methods = set()
+    if status != 500:
+        failures.append(f"raising fulfillment returned {status}, expected 500")
+
+    started = time.time()
+    response = client.post("/webhook/flutterwave", json=payment(9002, 501))
+    if response.status_code != 200 or time.time() - started > 3:
+        failures.append(f"same user after a failure: {response.status_code} in {time.time() - started:.1f}s")
+
+    response = client.post("/webhook/flutterwave", json=payment(9001, 501))
+    if response.get_json().get("status") != "success":
+        failures.append(f"retry after a failure returned {response.get_json()}")
+
+    # A second delivery while the first is in its inter-message delay
+    first = {}
+    thread = threading.Thread(target=lambda: first.update(
+        response=app.app.test_client().post("/webhook/flutterwave", json=payment(9003, 502))))
+    thread.start()
+    time.sleep(0.5)
+    concurrent = client.post("/webhook/flutterwave", json=payment(9003, 502)).status_code
+    thread.join()
+    after = client.post("/webhook/flutterwave", json=payment(9003, 502)).get_json().get("status")
+    if concurrent != 503 or first["response"].get_json().get("status") != "success" or after != "duplicate":
+        failures.append(f"mid-fulfillment delivery got {concurrent}, later delivery got {after!r}")
+
+    print(f"Single-process cases: {'OK' if not failures else '; '.join(failures)}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", choices=["sqlite", "redis"], default="sqlite")
+    parser.add_argument("--url", help="Shared state URL (default: temp SQLite file or local stand-in)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--transactions", type=int, default=40)
+    parser.add_argument("--lease-ttl", type=int, default=2)
+    parser.add_argument("--processing-ttl", type=float, default=4.0)
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--kill-after", type=float, default=3.0)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--log", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return worker(args)
+
+    workdir = tempfile.mkdtemp(prefix="failover_")
+    log = os.path.join(workdir, "events.log")
+    url = args.url
+    if not url and args.backend == "redis":
+        url = f"redis://127.0.0.1:{start_standin().server_address[1]}/0"
+    elif not url:
+        url = f"sqlite:///{os.path.join(workdir, 'state.db')}"
+    stub = start_stub(0)
+    stub_url = f"http://127.0.0.1:{stub.server_port}"
+
+    failures = single_process_cases(stub_url, url, workdir)
+
+    common = ["--log", log, "--transactions", str(args.transactions),
+              "--processing-ttl", str(args.processing_ttl), "--duration", str(args.duration)]
+    processes, stubs = {}, {}
+    for i in range(args.workers):
+        node = f"node-{i}"
+        # Each node gets its own stub so we can see what it is in the middle of
+        handler = type(f"Stub_{i}", (StubUpstreamHandler,), {"calls": []})
+        stubs[node] = start_stub(0, handler)
+        env = app_env(f"http://127.0.0.1:{stubs[node].server_port}", url, os.path.join(workdir, f"{node}.db"))
+        env.update(NODE_ID=node, LEASE_TTL=str(args.lease_ttl))
+        processes[node] = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--worker", node] + common, env=env)
+
+    from app import make_shared_state
+    state = make_shared_state(url)
+
+    # Kill the leader while it is between its two messages for some transaction
+    started_at = time.time()
+    time.sleep(args.kill_after)
+    leader, interrupted = None, set()
+    while time.time() - started_at < args.duration / 2:
+        leader = state.get("leader")
+        interrupted = in_flight(stubs[leader].RequestHandlerClass.calls) if leader else set()
+        if interrupted:
+            break
+        time.sleep(0.02)
+    killed_at = time.time()
+    if leader:
+        processes[leader].send_signal(signal.SIGKILL)
+    print(f"Killed leader {leader} at t+{killed_at - started_at:.1f}s "
+          f"in the middle of transaction(s) {sorted(interrupted)}")
+
+    for process in processes.values():
+        process.wait()
+    for server in [stub] + list(stubs.values()):
+        server.shutdown()
+    calls = [call for server in stubs.values() for call in server.RequestHandlerClass.calls]
+
+    # The welcome message names the transaction and its link; the quick-access message
+    # with that link is the last step before a fulfillment completes
+    link_to_transaction, started, completed = {}, {}, {}
+    for path, body in calls:
+        if not path.endswith("/sendMessage"):
+            continue
+        match = re.search(r"Transaction ID:</b> (\d+)", body["text"])
+        link = re.search(r"https://t\.me/\+stub\d+", body["text"])
+        if match:
+            transaction_id = int(match.group(1))
+            started[transaction_id] = started.get(transaction_id, 0) + 1
+            if link:
+                link_to_transaction[link.group(0)] = transaction_id
+        elif link and link.group(0) in link_to_transaction:
+            transaction_id = link_to_transaction[link.group(0)]
+            completed[transaction_id] = completed.get(transaction_id, 0) + 1
+
+    leaders = []
+    with open(log) as f:
+        for line in f:
+            kind, *rest = line.split()
+            if kind == "leader":
+                leaders.append((float(rest[1]), rest[0]))
+
+    duplicates = {tx: n for tx, n in completed.items() if n > 1}
+    missing = sorted(set(range(args.transactions)) - set(completed))
+    retried = sum(n - 1 for n in started.values())
+    takeover = next((t for t, node in sorted(leaders) if t > killed_at and node != leader), None)
+
+    print(f"Backend: {url}")
+    print(f"Completed {len(completed)}/{args.transactions} fulfillments; "
+          f"{retried} attempt(s) restarted after the kill")
+    print(f"Duplicates: {len(duplicates)}, missing: {len(missing)}")
+    print(f"New leader after failover: "
+          f"{'none' if takeover is None else f'{takeover - killed_at:.2f}s after kill'}")
+
+    if not interrupted:
+        failures.append("leader was never caught mid-fulfillment")
+    if failures or duplicates or missing or takeover is None:
+        print("FAIL")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Drive synthetic payment and chat_member/chat_join_request streams through the app.
+
+Pays for a set of users through /webhook/flutterwave (one payment is retried after
+the node dies having sent the link, so it gets a second link), then sends a shuffled stream
+of join, leave, foreign-link, join-request and other-chat updates to /webhook/telegram and runs
+the revocation sweep past link expiry. Checks that joins map back to the right
+transactions, only paid users are auto-approved, and no links are left active.
+
+Usage: python check_invite_tracking.py [--users 12]
+"""
+import os
+import sys
+import random
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from replay_webhooks import StubUpstreamHandler, start_stub
+
+CHANNEL_ID = -1001
+OTHER_CHAT_ID = -2002
+
+
+def chat_member(user_id, old_status, new_status, date, invite_link=None, chat_id=CHANNEL_ID):
+    update = {
+        "chat": {"id": chat_id, "type": "channel"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Synthetic"},
+        "date": date,
+        "old_chat_member": {"user": {"id": user_id}, "status": old_status},
+        "new_chat_member": {"user": {"id": user_id}, "status": new_status},
+    }
+    if invite_link:
+        update["invite_link"] = {"invite_link": invite_link, "creates_join_request": False}
+    return {"chat_member": update}
+
+
+def join_request(user_id, date, chat_id=CHANNEL_ID):
+    return {"chat_join_request": {
+        "chat": {"id": chat_id, "type": "channel"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Synthetic"},
+        "user_chat_id": user_id,
+        "date": date,
+    }}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=12)
+    args = parser.parse_args()
+
+    stub = start_stub(0)
+    stub_url = f"http://127.0.0.1:{stub.server_port}"
+    workdir = tempfile.mkdtemp(prefix="invites_")
+    os.environ.update(
+        STARTUP_WARMUP="false",
+        TELEGRAM_API_BASE=stub_url,
+        FLUTTERWAVE_API_BASE=stub_url,
+        TELEGRAM_BOT_TOKEN="stub-token",
+        TELEGRAM_CHANNEL_ID=str(CHANNEL_ID),
+        DATABASE_PATH=os.path.join(workdir, "bot.db"),
+    )
+    os.environ.pop("FLUTTERWAVE_WEBHOOK_SECRET", None)
+    os.environ.pop("WEBHOOK_CAPTURE_PATH", None)
+
+    import app
+    app.logger.disabled = True
+    # The check runs the sweep itself at chosen times
+    app.cluster.stop()
+    client = app.app.test_client()
+    rng = random.Random(31)
+
+    paid_users = list(range(1000, 1000 + args.users))
+    unpaid_user = 999
+
+    def pay(user_id):
+        return app.app.test_client().post("/webhook/flutterwave", json={
+            "event": "charge.completed",
+            "data": {"id": user_id * 10, "status": "successful", "amount": 1000, "currency": "NGN",
+                     "meta": {"telegram_user_id": str(user_id)}},
+        }).status_code
+
+    # The first fulfillment for one user fails after its link went out; Flutterwave's
+    # retry sends a second link, and the first one must stay tracked
+    retried = paid_users[0]
+    complete_transaction = app.cluster.complete_transaction
+
+    def fail_once(transaction_id, token):
+        if transaction_id == retried * 10 and not failed:
+            failed.append(transaction_id)
+            raise RuntimeError("node died after sending the invite link")
+        complete_transaction(transaction_id, token)
+
+    failed = []
+    app.cluster.complete_transaction = fail_once
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        statuses = dict(zip(paid_users, pool.map(pay, paid_users)))
+    assert statuses.pop(retried) == 500 and all(status == 200 for status in statuses.values())
+    assert pay(retried) == 200
+
+    rows = app.invite_tracker.conn.execute("SELECT user_id, invite_link FROM invite_links ORDER BY rowid").fetchall()
+    all_links = [link for _, link in rows]
+    # Everyone joins through the first link they were sent
+    links = {}
+    for user_id, link in rows:
+        links.setdefault(user_id, link)
+    created_at = app.invite_tracker.conn.execute("SELECT MIN(created_at) FROM invite_links").fetchone()[0]
+
+    # Half of the users join through their own link, one through a link someone shared,
+    # one through a join request; the rest never join the channel, though one joins
+    # and asks to join another chat where the bot is admin
+    joiners = paid_users[: args.users // 2]
+    sharer, requester, elsewhere = paid_users[-1], paid_users[-2], paid_users[-3]
+    updates = [chat_member(u, "left", "member", created_at + rng.randint(5, 3600), links[str(u)]) for u in joiners]
+    updates += [chat_member(u, "member", "left", created_at + 4000) for u in joiners[:2]]
+    updates += [chat_member(unpaid_user, "left", "member", created_at + 60, links[str(sharer)])]
+    updates += [join_request(requester, created_at + 30), join_request(unpaid_user, created_at + 40)]
+    updates += [chat_member(elsewhere, "left", "member", created_at + 50, chat_id=OTHER_CHAT_ID),
+                join_request(elsewhere, created_at + 20, chat_id=OTHER_CHAT_ID)]
+    rng.shuffle(updates)
+
+    for update in updates:
+        assert client.post("/webhook/telegram", json=update).status_code == 200
+    assert client.post("/webhook/telegram", json=chat_member(requester, "left", "member", created_at + 90)).status_code == 200
+
+    approved = [body["user_id"] for path, body in StubUpstreamHandler.calls if path.endswith("/approveChatJoinRequest")]
+    before_sweep = app.invite_tracker.stats(now=created_at + 1)
+    revoked_used = app.sweep_invite_links(now=created_at + 1)
+    revoked_expired = app.sweep_invite_links(now=created_at + app.INVITE_LINK_TTL + 1)
+    after_sweep = app.invite_tracker.stats(now=created_at + app.INVITE_LINK_TTL + 1)
+    revoke_calls = [body["invite_link"] for path, body in StubUpstreamHandler.calls if path.endswith("/revokeChatInviteLink")]
+
+    joined_rows = dict(app.invite_tracker.conn.execute(
+        "SELECT user_id, joined_user_id FROM invite_links WHERE joined_at IS NOT NULL").fetchall())
+
+    failures = []
+    expected_joins = {str(u): str(u) for u in joiners}
+    expected_joins.update({str(sharer): str(unpaid_user), str(requester): str(requester)})
+    if joined_rows != expected_joins:
+        failures.append(f"joins mapped to {joined_rows}, expected {expected_joins}")
+    if approved != [requester]:
+        failures.append(f"approved {approved}, expected only {requester}")
+    if before_sweep["joined"] != len(expected_joins):
+        failures.append(f"stats report {before_sweep['joined']} joins")
+    if after_sweep["active"] or after_sweep["expired_unrevoked"]:
+        failures.append(f"links left active after sweep: {after_sweep}")
+    if len(all_links) != len(paid_users) + 1:
+        failures.append(f"tracked {len(all_links)} links for {len(paid_users) + 1} sent")
+    if sorted(revoke_calls) != sorted(all_links):
+        failures.append("not every link was revoked exactly once")
+
+    print(f"Paid users: {len(paid_users)}, updates: {len(updates) + 1}, approved join requests: {approved}")
+    print(f"Before sweep: {before_sweep}")
+    print(f"Revoked {revoked_used} used links, then {revoked_expired} expired links")
+    print(f"After sweep: {after_sweep}")
+
+    stub.shutdown()
+    if failures:
+        print("FAIL: " + "; ".join(failures))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""Replay a webhook capture (WEBHOOK_CAPTURE_PATH) against a local instance.
+
+Telegram and Flutterwave are replaced by a built-in stub server. Unless --target
+is given, a local instance of app.py is started and pointed at the stubs.
+
+Usage:
+    python replay_webhooks.py capture.jsonl                 # original timing
+    python replay_webhooks.py capture.jsonl --speed 10      # 10x faster
+    python replay_webhooks.py capture.jsonl --speed max     # as fast as possible
+"""
+import os
+import sys
+import json
+import hmac
+import time
+import socket
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+
+class StubUpstreamHandler(BaseHTTPRequestHandler):
+    """Answers the Telegram Bot API and Flutterwave calls the app makes"""
+
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    lock = threading.Lock()
+    calls = []
+    # Telegram methods that answer {"ok": true} without a usable result
+    broken_methods = set()
+
+    def reply(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        with self.lock:
+            self.calls.append((self.path.split("?")[0], json.loads(body) if body else None))
+            call_number = len(self.calls)
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self.path.startswith("/bot"):
+            method = self.path.split("?")[0].rsplit("/", 1)[-1]
+            result = {
+                "getMe": {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot"},
+                "getChat": {"id": -1001, "title": "Stub Channel", "type": "channel"},
+                "createChatInviteLink": {"invite_link": f"https://t.me/+stub{call_number}"},
+            }.get(method, True)
+            if method in self.broken_methods:
+                result = {}
+            body = {"ok": True, "result": result}
+        elif self.path.startswith("/v3/payments"):
+            body = {"status": "success", "data": {"link": "https://checkout.example/stub"}}
+        else:
+            body = {"status": "success", "data": {"status": "successful"}}
+
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = reply
+
+    def log_message(self, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_stub(latency, handler=StubUpstreamHandler):
+    handler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", free_port()), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_app(stub_url, workdir):
+    """Run app.py on a free port with both upstreams pointed at the stub"""
+    port = free_port()
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        TELEGRAM_API_BASE=stub_url,
+        FLUTTERWAVE_API_BASE=stub_url,
+        TELEGRAM_BOT_TOKEN="stub-token",
+        TELEGRAM_CHANNEL_ID="-1001",
+        FLUTTERWAVE_SECRET_KEY="stub-secret",
+        DATABASE_PATH=os.path.join(workdir, "replay.db"),
+    )
+    env.pop("WEBHOOK_CAPTURE_PATH", None)
+    env.pop("FLUTTERWAVE_WEBHOOK_SECRET", None)
+
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    process = subprocess.Popen(
+        [sys.executable, app_path], env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    target = f"http://127.0.0.1:{port}"
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get(f"{target}/health", timeout=1)
+            return process, target
+        except requests.RequestException:
+            time.sleep(0.1)
+
+    process.kill()
+    raise RuntimeError("Local instance did not start within 30s")
+
+
+def load_capture(path):
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda record: record["t"])
+    return records
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def replay(records, target, speed, concurrency, webhook_secret=None):
+    """Re-drive the capture and return per-request results"""
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+    def send(record, due):
+        body = json.dumps(record["body"]).encode() if record["body"] is not None else b""
+        headers = {"Content-Type": record["headers"].get("content-type", "application/json")}
+        if webhook_secret and record["path"].endswith("/flutterwave"):
+            headers["verif-hash"] = hmac.new(webhook_secret.encode(), body, hashlib.sha256).hexdigest()
+
+        started = time.perf_counter()
+        try:
+            status = session.post(target + record["path"], data=body, headers=headers, timeout=60).status_code
+        except requests.RequestException:
+            status = None
+        finished = time.perf_counter()
+        return {
+            "path": record["path"],
+            "status": status,
+            "latency_ms": (finished - started) * 1000,
+            "lag_ms": max(0.0, started - due) * 1000,
+        }
+
+    first = records[0]["t"] if records else 0
+    started = time.perf_counter()
+    futures = []
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for record in records:
+            due = started if speed is None else started + (record["t"] - first) / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(send, record, due))
+        results = [future.result() for future in futures]
+
+    return results, time.perf_counter() - started
+
+
+def summarize(results, elapsed):
+    summary = {"requests": len(results), "elapsed_s": round(elapsed, 3),
+               "throughput_rps": round(len(results) / elapsed, 2) if elapsed else 0.0, "paths": {}}
+
+    for path in sorted({r["path"] for r in results}):
+        subset = [r for r in results if r["path"] == path]
+        latencies = sorted(r["latency_ms"] for r in subset)
+        lags = sorted(r["lag_ms"] for r in subset)
+        statuses = {}
+        for r in subset:
+            statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+        summary["paths"][path] = {
+            "requests": len(subset),
+            "statuses": statuses,
+            "latency_ms": {p: round(percentile(latencies, v), 2)
+                           for p, v in (("p50", 50), ("p90", 90), ("p99", 99), ("max", 100))},
+            "schedule_lag_p99_ms": round(percentile(lags, 99), 2),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("capture", help="Capture file written with WEBHOOK_CAPTURE_PATH")
+    parser.add_argument("--target", help="Base URL of a running instance (default: start one)")
+    parser.add_argument("--speed", default="1", help="Time scale factor, e.g. 1, 10, or 'max'")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0, help="Added latency of stubbed upstreams")
+    parser.add_argument("--webhook-secret", help="Re-sign Flutterwave bodies for a target that checks signatures")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = parser.parse_args()
+
+    speed = None if args.speed == "max" else float(args.speed)
+    records = load_capture(args.capture)
+    if not records:
+        parser.error("capture is empty")
+
+    process = None
+    stub = None
+    workdir = tempfile.mkdtemp(prefix="replay_")
+    try:
+        target = args.target
+        if not target:
+            stub = start_stub(args.stub_latency_ms / 1000)
+            process, target = start_app(f"http://127.0.0.1:{stub.server_port}", workdir)
+
+        results, elapsed = replay(records, target.rstrip("/"), speed, args.concurrency, args.webhook_secret)
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+        if stub:
+            stub.shutdown()
+
+    summary = summarize(results, elapsed)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+
+    print(f"Replayed {summary['requests']} requests in {summary['elapsed_s']}s "
+          f"({summary['throughput_rps']} req/s, speed={args.speed})")
+    print(f"{'path':<24}{'n':>7}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}  statuses")
+    for path, stats in summary["paths"].items():
+        latency = stats["latency_ms"]
+        print(f"{path:<24}{stats['requests']:>7}{latency['p50']:>10}{latency['p90']:>10}"
+              f"{latency['p99']:>10}{latency['max']:>10}  {stats['statuses']}")
+
+
+if __name__ == "__main__":
+    main()